@@ -4,7 +4,6 @@ from openai import OpenAI           # openaiライブラリ
 import utils                        # utilsモジュール
 from datetime import datetime       # 日付利用
 import time                         # 実行時間計測
-from PIL import Image               # 画像処理ライブラリ
 
 import tempfile                     # 一時ファイル管理
 from pathlib import Path            # ファイルシステムパス操作
@@ -13,6 +12,7 @@ from langchain_core.messages import HumanMessage
 from langchain.callbacks import get_openai_callback
 
 from twitter_post import twitter_post
+import upload_guard                 # アップロード画像の検証・メモリ予算管理
 from OpenAI import model_init
 
 from script_scanVisualDocuments import scan_file  # 図表文書スキャン用スクリプト
@@ -59,7 +59,7 @@ def process_uploaded_file(api_base_url, auth_token, uploaded_file, model):
         model (str): 画像処理に使用するモデル
 
     Returns:
-        str: 処理の成功もしくは失敗メッセージ
+        tuple: (ステータスコード, 処理の成功もしくは失敗メッセージ)
     """
     # 一時ディレクトリを作成
     with tempfile.TemporaryDirectory() as temp_dir:
@@ -72,80 +72,151 @@ def process_uploaded_file(api_base_url, auth_token, uploaded_file, model):
         status_code, result_path, request_id = scan_file(temp_file_path, api_base_url, auth_token, model)
 
         if status_code == 0:
-            return f"画像が正常に読み込めました"
+            return status_code, f"画像が正常に読み込めました"
         else:
-            return f"画像読み込みに失敗しました。 Check logs for Request ID: {request_id}"
+            return status_code, f"画像読み込みに失敗しました。 Check logs for Request ID: {request_id}"
 
 def make_imagetext(uploaded_file):
     mime_type = uploaded_file.type  # 'image/png'
-    uploaded_file.seek(0)  # 念のため先頭に戻す
-    image_data = uploaded_file.read()
-    encoded = base64.b64encode(image_data).decode("utf-8")
+    # getbuffer()はコピーを作らずにアップロード済みのバイト列を参照する
+    encoded = base64.b64encode(uploaded_file.getbuffer()).decode("utf-8")
     return {
         "type": "image_url",
         "image_url": {"url": f"data:{mime_type};base64,{encoded}"}
     }
 
-def prior_knowledge(uploaded_file, input_text):
+# 投稿チェックの指示とチェックリスト（画像あり・なしで共通）
+RISK_CHECK_INSTRUCTIONS = (
+    "まず1行目には、リスクがあるなら 'yes' と、ないなら 'no' とだけ出力します。\n" +
+    "2行目以降には、この投稿によって生じる可能性のあるさまざまなリスクについて、日本語で箇条書きで丁寧に洗い出してください。\n" +
+    "また、それぞれのリスクに対して「なぜそれがリスクになるのか」「それを避けるにはどうすべきか」という視点から、具体的な対策を添えてください。\n" +
+    "以下のチェックリストに掲載されていないリスクを出力する必要はありません。\n" +
+    "チェックしていただきたいリスクは以下の通りです：\n" +
+    "1. 個人情報・身バレリスク\n" +
+    "・画像に移っている場所・輻輳・名札・建物・部屋の背景などから、投稿者の身元が特定される可能性はないか\n" +
+    "・文章に含まれる地名・職場・学校・人間関係・行動履歴などから居住地や生活パターンが推測されないか\n" +
+    "・投稿に写る他社（特に未成年・家族・友人）のプライバシーが侵害される要素ないか\n" +
+    "・指の腹が写っていて指紋を偽造される可能性はないか\n" +
+    "2. 誤読・炎上・誤解のリスク\n" +
+    "・文章の言い回しに曖昧さ・誤読されやすい表現が含まれていないか\n" +
+    "・画像と文章の組み合わせにより、意図と異なる意味や解釈が生まれていないか\n" +
+    "・投稿内容が一部の人に不快感・差別的印象・攻撃的印象を与える可能性はないか\n" +
+    "・ユーモア・皮肉・風刺が伝わらず、炎上を招くリスクがないか\n" +
+    "・投稿するタイミングや文脈により、「空気が読めない」「不適切」と受け取られる懸念がないか\n"
+)
+
+def image_analysis_prompt(uploaded_file):
     """
     Parameters:
-    - uploaded_files: List[UploadedFile]（例えば Streamlit の st.file_uploader(..., accept_multiple_files=True) で得たもの）
+    - uploaded_file: UploadedFile（Streamlit の st.file_uploader で得たもの）
 
     Returns:
     - List[HumanMessage]
     """
-    if uploaded_file is not None:
-        image = make_imagetext(uploaded_file)
-        message = HumanMessage(
-            content=[
-                {"type": "text", "text":
-                "以下にSNSに投稿予定の「画像」と「文章」を提示します。\n" +
-                "まず1行目には、リスクがあるなら 'yes' と、ないなら 'no' とだけ出力します。\n" +
-                "2行目以降には、この投稿によって生じる可能性のあるさまざまなリスクについて、日本語で箇条書きで丁寧に洗い出してください。\n" +
-                "また、それぞれのリスクに対して「なぜそれがリスクになるのか」「それを避けるにはどうすべきか」という視点から、具体的な対策を添えてください。\n" +
-                "以下のチェックリストに掲載されていないリスクを出力する必要はありません。\n" +
-                "チェックしていただきたいリスクは以下の通りです：\n" +
-                "1. 個人情報・身バレリスク\n" +
-                "・画像に移っている場所・輻輳・名札・建物・部屋の背景などから、投稿者の身元が特定される可能性はないか\n" +
-                "・文章に含まれる地名・職場・学校・人間関係・行動履歴などから居住地や生活パターンが推測されないか\n" +
-                "・投稿に写る他社（特に未成年・家族・友人）のプライバシーが侵害される要素ないか\n" +
-                "・指の腹が写っていて指紋を偽造される可能性はないか\n" +
-                "2. 誤読・炎上・誤解のリスク\n" +
-                "・文章の言い回しに曖昧さ・誤読されやすい表現が含まれていないか\n" +
-                "・画像と文章の組み合わせにより、意図と異なる意味や解釈が生まれていないか\n" +
-                "・投稿内容が一部の人に不快感・差別的印象・攻撃的印象を与える可能性はないか\n" +
-                "・ユーモア・皮肉・風刺が伝わらず、炎上を招くリスクがないか\n" +
-                "・投稿するタイミングや文脈により、「空気が読めない」「不適切」と受け取られる懸念がないか\n" +
-                f"投稿文：{input_text if input_text else '（投稿文なし）'}"},
-                image
-            ]
+    image = make_imagetext(uploaded_file)
+    message = HumanMessage(
+        content=[
+            {"type": "text", "text":
+            "以下にSNSに投稿予定の「画像」を提示します。\n" +
+            "後で投稿文と組み合わせてリスクを判定するため、画像から読み取れる情報を日本語で箇条書きで客観的に洗い出してください。\n" +
+            "特に以下の観点について、写っているものとその位置・見え方をできるだけ具体的に記述してください：\n" +
+            "・場所を推測できる手がかり（風景・建物・看板・地名・部屋の背景など）\n" +
+            "・身元を特定できる手がかり（服装・名札・制服・書類・画面の表示など）\n" +
+            "・写っている人物（顔の有無、未成年・家族・友人と思われる人物を含む）\n" +
+            "・指の腹や指紋が読み取れる可能性のある部分\n" +
+            "・画像全体の雰囲気や、見る人によって不快・不適切と受け取られうる要素\n" +
+            "リスクの有無の判定（'yes' / 'no'）は出力しないでください。"},
+            image
+        ]
+    )
+    return [message]
+
+def prior_knowledge(input_text, image_summary=None):
+    """
+    Parameters:
+    - input_text: str 投稿文
+    - image_summary: str | None analyze_image で得た画像の分析結果（画像なしの場合は None）
+
+    Returns:
+    - List[HumanMessage]
+    """
+    if image_summary is not None:
+        text = (
+            "以下にSNSに投稿予定の「画像の分析結果」と「文章」を提示します。\n" +
+            "画像そのものの代わりに、事前に行った画像の分析結果をもとに判断してください。\n" +
+            RISK_CHECK_INSTRUCTIONS +
+            f"画像の分析結果：\n{image_summary}\n"
         )
     else:
-        message = HumanMessage(
-            content=[
-                {"type": "text", "text":
-                "以下にSNSに投稿予定の「文章」を提示します。\n" +
-                "まず1行目には、リスクがあるなら 'yes' と、ないなら 'no' とだけ出力します。\n" +
-                "2行目以降には、この投稿によって生じる可能性のあるさまざまなリスクについて、日本語で箇条書きで丁寧に洗い出してください。\n" +
-                "また、それぞれのリスクに対して「なぜそれがリスクになるのか」「それを避けるにはどうすべきか」という視点から、具体的な対策を添えてください。\n" +
-                "以下のチェックリストに掲載されていないリスクを出力する必要はありません。\n" +
-                "チェックしていただきたいリスクは以下の通りです：\n" +
-                "1. 個人情報・身バレリスク\n" +
-                "・画像に移っている場所・輻輳・名札・建物・部屋の背景などから、投稿者の身元が特定される可能性はないか\n" +
-                "・文章に含まれる地名・職場・学校・人間関係・行動履歴などから居住地や生活パターンが推測されないか\n" +
-                "・投稿に写る他社（特に未成年・家族・友人）のプライバシーが侵害される要素ないか\n" +
-                "・指の腹が写っていて指紋を偽造される可能性はないか\n" +
-                "2. 誤読・炎上・誤解のリスク\n" +
-                "・文章の言い回しに曖昧さ・誤読されやすい表現が含まれていないか\n" +
-                "・画像と文章の組み合わせにより、意図と異なる意味や解釈が生まれていないか\n" +
-                "・投稿内容が一部の人に不快感・差別的印象・攻撃的印象を与える可能性はないか\n" +
-                "・ユーモア・皮肉・風刺が伝わらず、炎上を招くリスクがないか\n" +
-                "・投稿するタイミングや文脈により、「空気が読めない」「不適切」と受け取られる懸念がないか\n" +
-                f"投稿文：{input_text if input_text else '（投稿文なし）'}"}
-            ]
-        )
+        text = "以下にSNSに投稿予定の「文章」を提示します。\n" + RISK_CHECK_INSTRUCTIONS
+    text += f"投稿文：{input_text if input_text else '（投稿文なし）'}"
 
-    return [message]
+    return [HumanMessage(content=[{"type": "text", "text": text}])]
+
+def get_image_key(uploaded_file):
+    """
+    画像分析結果のキャッシュに用いる、アップロードごとのIDを返す
+
+    Args:
+        uploaded_file (UploadedFile or None): アップロードされたファイル
+
+    Returns:
+        str or None: Streamlitがアップロードごとに割り当てるfile_id。画像なしの場合はNone
+    """
+    if uploaded_file is None:
+        return None
+    return uploaded_file.file_id
+
+def analyze_image(uploaded_file):
+    """
+    画像分析ステージ。画像ごとに1回だけ実行し、結果はセッションにキャッシュする
+
+    Args:
+        uploaded_file (UploadedFile): アップロードされたファイル
+
+    Returns:
+        str: 画像から読み取れる情報のテキスト
+    """
+    llm = model_init("gpt-4o", temperature=1.0)
+    with get_openai_callback() as cb:
+        res = llm.invoke(image_analysis_prompt(uploaded_file), config={"max_tokens": 1000})
+    return str(res.content)
+
+def check_post(input_text, image_summary):
+    """
+    投稿文チェックステージ。画像は送らず、投稿文と画像の分析結果からリスクを判定する
+
+    Args:
+        input_text (str): 投稿文
+        image_summary (str or None): 画像の分析結果（画像なしの場合はNone）
+
+    Returns:
+        str: 1行目が 'yes' または 'no' のチェック結果
+    """
+    llm = model_init("gpt-4o", temperature=1.0)
+    with get_openai_callback() as cb:
+        res = llm.invoke(prior_knowledge(input_text, image_summary), config={"max_tokens": 1000})
+    return str(res.content)
+
+def run_text_check(request_key, input_text, image_summary):
+    """
+    投稿文チェックの結果を返す。画像と投稿文が前回のチェックと同じであれば、その結果を再利用する
+
+    Args:
+        request_key (tuple): (画像のID, 投稿文)
+        input_text (str): 投稿文
+        image_summary (str or None): 画像の分析結果
+
+    Returns:
+        str: 1行目が 'yes' または 'no' のチェック結果
+    """
+    cached = st.session_state.get("text_check")
+    if cached is not None and cached["key"] == request_key:
+        return cached["content"]
+
+    content = check_post(input_text, image_summary)
+    st.session_state["text_check"] = {"key": request_key, "content": content}
+    return content
 
 st.title("Persona Shield")
 
@@ -204,40 +275,70 @@ char_count = len(input_text)
 # 画像アップロード
 uploaded_file = st.file_uploader("画像を追加", type=["png"], label_visibility="collapsed")
 if uploaded_file:
-    image = Image.open(uploaded_file)
-    st.image(image, caption="プレビュー", use_column_width=True)
+    # ヘッダーのみでサイズを検証し、上限を超える画像はデコード前に拒否する
+    image_error = upload_guard.check_image(uploaded_file)
+    if image_error:
+        st.error(image_error)
+        st.stop()
+    # 元画像をst.imageに渡すと再実行のたびにデコード・縮小されるため、
+    # 縮小プレビューを画像ごとに1回だけ作成してセッションにキャッシュする
+    preview = st.session_state.get("preview")
+    if preview is None or preview["key"] != uploaded_file.file_id:
+        preview_data = upload_guard.make_preview(uploaded_file)
+        if preview_data is None:
+            st.error("現在混み合っています。しばらくしてから再度お試しください。")
+            st.stop()
+        preview = {"key": uploaded_file.file_id, "data": preview_data}
+        st.session_state["preview"] = preview
+    st.image(preview["data"], caption="プレビュー", use_column_width=True)
 
 # 質問送信ボタンがクリックされたらLLMに質問を要求する
 if st.button("投稿", key="post_ready"):
     now = datetime.now()
     file_time = now.strftime("%Y%m%d%H%M%S") + str(int(time.time() % 1 * 1000))
 
+    image_key = get_image_key(uploaded_file)
+    image_summary = None
+
     if uploaded_file is not None:
-        # 画像を開く
-        image = Image.open(uploaded_file)
-        
-        api_base_url = "/".join(utils.ENDPOINT_BASE.split("/")[:-2])
-        auth_token = utils.API_KEY
-        model = utils.SCAN_VISUAL_MODEL
+        # 画像ごとのスキャン結果と分析結果はセッションにキャッシュし、画像が変わらない限り再利用する
+        image_analysis = st.session_state.get("image_analysis")
+        if image_analysis is None or image_analysis["key"] != image_key:
+            image_analysis = {"key": image_key, "scan_ok": False, "scan_message": None, "summary": None}
+            st.session_state["image_analysis"] = image_analysis
 
-        result_message = process_uploaded_file(api_base_url, auth_token, uploaded_file, model)
-        st.write(result_message)
+        # スキャンは成功するまで投稿のたびに再試行する
+        if not image_analysis["scan_ok"]:
+            api_base_url = "/".join(utils.ENDPOINT_BASE.split("/")[:-2])
+            auth_token = utils.API_KEY
+            model = utils.SCAN_VISUAL_MODEL
 
-    # VLMの初期化
-    llm = model_init("gpt-4o", temperature=1.0)
-    messages = prior_knowledge(uploaded_file, input_text)
+            # スキャンAPIへの送信はストリーミングのため、メモリ予算は確保せずに処理する
+            status_code, image_analysis["scan_message"] = process_uploaded_file(api_base_url, auth_token, uploaded_file, model)
+            image_analysis["scan_ok"] = status_code == SUCCESS_CODE
+        st.write(image_analysis["scan_message"])
 
-    with get_openai_callback() as cb:
-        res = llm.invoke(messages, config={"max_tokens": 1000})
+        # 画像分析ステージ（画像ごとに初回のみ）
+        if image_analysis["summary"] is None:
+            # 画像分析はストリーミングできないため、プロセス全体のメモリ予算を確保してから処理する
+            with upload_guard.reserve_upload(uploaded_file) as reserved:
+                if not reserved:
+                    st.error("現在混み合っています。しばらくしてから再度お試しください。")
+                    st.stop()
+                image_analysis["summary"] = analyze_image(uploaded_file)
+        image_summary = image_analysis["summary"]
+
+    # 投稿文チェックステージ（投稿文と画像の分析結果のみで判定）
+    content = run_text_check((image_key, input_text), input_text, image_summary)
 
     # ファイル名に現在日時を付与
     context_file_name = "./debug/output_context_{}.txt".format(file_time)
     # ファイルに書き出す
     with open(context_file_name, "w", encoding="utf8") as f:
-        f.write(str(res.content))
+        f.write(content)
     
     # === VLM出力に応じた処理 ===
-    output_lines = str(res.content).strip().split("\n")
+    output_lines = content.strip().split("\n")
     first_line = output_lines[0].strip().lower()
     remaining_output = "\n".join(output_lines[1:]).strip()
 
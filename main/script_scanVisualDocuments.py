@@ -2,7 +2,7 @@
 このモジュールは、画像ファイルをスキャンしテキスト化するためのユーティリティ関数です。
 
 機能:
-- ファイルをBase64形式にエンコードする関数
+- ファイルをBase64エンコードしながらJSONリクエストボディとして逐次読み出すクラス
 - 画像ファイルをテキスト化するための関数群
 - テキスト化されたファイルをAPIに送信する関数
 
@@ -15,11 +15,13 @@
     POLLING_INTERVAL (int): ポーリング時の待機時間（秒）
     FILE_INTERVAL (int): 複数ファイルを処理する際のファイル間の待機時間（秒）
     CERT (str or bool): SSL証明書の指定
+    ENCODE_CHUNK_SIZE (int): ストリーミング送信時に一度にエンコードするバイト数
 
-関数:
-    encode_file_to_base64(file_path)
-        ファイルをBase64エンコードします。
+クラス:
+    Base64JsonBody(file_path, fields)
+        ファイルをBase64エンコードしながら、JSON形式のリクエストボディとして逐次読み出します。
 
+関数:
     scan(api_base_url, auth_token, file_path, model)
         画像ファイルをテキスト化処理のためにAPIに送信します。
 
@@ -56,21 +58,65 @@ FAILURE_CODE = 1 # 失敗時のステータスコード
 POLLING_INTERVAL = 10 # ポーリング時の待機時間（秒）
 FILE_INTERVAL = 10 # 複数ファイルを処理する際のファイル間の待機時間（秒）
 CERT = True # SSL証明書の指定
+ENCODE_CHUNK_SIZE = 3 * 64 * 1024 # ストリーミング送信時に一度にエンコードするバイト数（Base64の区切りに合わせ3の倍数）
 
 
-def encode_file_to_base64(file_path: str) -> str:
+class Base64JsonBody:
     """
-    ファイルをBase64エンコードします。
-
-    Args:
-        file_path (str): エンコードするファイルのパス。
+    ファイルをBase64エンコードしながら、JSON形式のリクエストボディとして逐次読み出すファイルライクオブジェクトです。
 
-    Returns:
-        str: Base64エンコードされたファイルの文字列。
+    ファイル全体やエンコード結果をメモリ上に保持せず、ENCODE_CHUNK_SIZEごとにエンコードして送信します。
+    ボディ長は事前に計算できるため、requestsはContent-Lengthを付与して送信します。
+    生成されるボディは {"file": "<Base64>", <fieldsの各項目>} の形式です。
     """
-    with open(file_path, "rb") as file:
-        encoded_string = base64.b64encode(file.read()).decode("ascii")
-    return encoded_string
+
+    def __init__(self, file_path: str, fields: dict):
+        """
+        Args:
+            file_path (str): エンコードするファイルのパス。
+            fields (dict): "file"以外にボディに含める項目。
+        """
+        self._file_path = file_path
+        self._prefix = b'{"file": "'
+        # fieldsのJSONから外側の{}を除いた部分を"file"の後ろに連結する
+        inner = json.dumps(fields).encode("ascii")[1:-1]
+        self._suffix = b'"' + (b", " + inner if inner else b"") + b"}"
+        file_size = os.path.getsize(file_path)
+        encoded_size = 4 * ((file_size + 2) // 3)
+        self._length = len(self._prefix) + encoded_size + len(self._suffix)
+        self._chunks = self._iter_chunks()
+        self._buffer = bytearray()
+
+    def __len__(self) -> int:
+        return self._length
+
+    def _iter_chunks(self):
+        yield self._prefix
+        with open(self._file_path, "rb") as file:
+            while data := file.read(ENCODE_CHUNK_SIZE):
+                yield base64.b64encode(data)
+        yield self._suffix
+
+    def read(self, size: int = -1) -> bytes:
+        """
+        ボディを最大sizeバイト読み出します。
+
+        Args:
+            size (int, optional): 読み出す最大バイト数。負の値の場合は残り全てを読み出します。
+
+        Returns:
+            bytes: 読み出したデータ。終端に達した場合は空のバイト列。
+        """
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+        if size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
 
 
 def scan(
@@ -92,15 +138,13 @@ def scan(
         tuple: (ステータスコード, リクエストID)
                成功時は(0, request_id)、失敗時は(エラーステータスコード, None)を返します。
     """
-    encoded_file = encode_file_to_base64(file_path)
     filename = os.path.basename(file_path)
 
-
-    payload = {
-        "file": encoded_file, # Base64エンコードされたファイル
+    # Base64エンコードされたファイルは送信時に逐次生成する
+    payload = Base64JsonBody(file_path, {
         "filename": filename, # ファイル名
         "model": model,       # モデル名
-    }
+    })
 
     headers = {
         "Content-Type": "application/json",      # コンテンツタイプ
@@ -109,7 +153,7 @@ def scan(
 
     try:
         # 変換をリクエスト
-        response = requests.post(api_base_url + utils.URI_SCAN, headers=headers, json=payload, verify=CERT)
+        response = requests.post(api_base_url + utils.URI_SCAN, headers=headers, data=payload, verify=CERT)
         now = datetime.now(ZoneInfo("Asia/Tokyo"))
 
         print(f"Processed {filename} at {now}: {response.status_code} {response.text}")
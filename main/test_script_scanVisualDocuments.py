@@ -0,0 +1,43 @@
+import base64                        # バイナリデータのエンコード・デコード
+import json                          # JSON形式のデータを扱うためのライブラリ
+import os                            # OS関連の機能
+
+import pytest
+
+from script_scanVisualDocuments import Base64JsonBody, ENCODE_CHUNK_SIZE
+
+
+def read_all(body, size):
+    """ボディをsizeバイトずつ終端まで読み出す"""
+    data = b""
+    while chunk := body.read(size):
+        data += chunk
+    return data
+
+
+@pytest.mark.parametrize("file_size", [0, 1, 2, 3, 100, ENCODE_CHUNK_SIZE - 1, ENCODE_CHUNK_SIZE * 2 + 5, 1_000_003])
+@pytest.mark.parametrize("fields", [{"filename": "画像.png", "model": "scan-std-model-v1-jp"}, {}])
+def test_base64_json_body_round_trip(tmp_path, file_size, fields):
+    file_data = os.urandom(file_size)
+    file_path = tmp_path / "image.png"
+    file_path.write_bytes(file_data)
+
+    body = Base64JsonBody(str(file_path), fields)
+    data = read_all(body, 8192)
+
+    assert len(data) == len(body)
+    payload = json.loads(data)
+    assert base64.b64decode(payload.pop("file")) == file_data
+    assert payload == fields
+
+
+def test_base64_json_body_read_all_at_once(tmp_path):
+    file_path = tmp_path / "image.png"
+    file_path.write_bytes(b"persona shield")
+
+    body = Base64JsonBody(str(file_path), {"model": "m"})
+    data = body.read()
+
+    assert len(data) == len(body)
+    assert json.loads(data) == {"file": base64.b64encode(b"persona shield").decode("ascii"), "model": "m"}
+    assert body.read() == b""
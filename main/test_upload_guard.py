@@ -0,0 +1,125 @@
+import io                            # バイト列のストリーム操作
+import struct                        # バイナリデータの組み立て
+import zlib                          # PNGチャンクのCRC計算
+
+import pytest
+from PIL import Image
+
+import upload_guard
+import utils
+
+
+class FakeUploadedFile(io.BytesIO):
+    """StreamlitのUploadedFileと同様にsize属性を持つBytesIO"""
+
+    @property
+    def size(self):
+        return len(self.getvalue())
+
+
+def png_bytes(width, height):
+    """実際の画像からPNGバイト列を作成する"""
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), "red").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def png_chunk(chunk_type, data):
+    """PNGチャンク（長さ・種類・データ・CRC）を作成する"""
+    body = chunk_type + data
+    return struct.pack(">I", len(data)) + body + struct.pack(">I", zlib.crc32(body))
+
+
+def png_header(width, height):
+    """画素データを持たない（IHDRと空のIDATのみの）PNGバイト列を作成する"""
+    ihdr = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + png_chunk(b"IHDR", ihdr) + png_chunk(b"IDAT", b"")
+
+
+def test_budget_acquire_release_accounting():
+    budget = upload_guard.UploadBudget(100)
+
+    assert budget.acquire(30)
+    assert budget.acquire(70)
+    assert budget._in_use == 100
+
+    budget.release(30)
+    assert budget._in_use == 70
+    budget.release(70)
+    assert budget._in_use == 0
+
+
+def test_budget_acquire_times_out():
+    budget = upload_guard.UploadBudget(100)
+    assert budget.acquire(80)
+
+    assert not budget.acquire(30, timeout=0.01)
+    assert budget._in_use == 80
+
+
+def test_budget_clamps_single_request_over_limit():
+    budget = upload_guard.UploadBudget(100)
+
+    # 上限を超える要求でも、他に処理中のものがなければ上限分だけ確保される
+    assert budget.acquire(500, timeout=0.01)
+    assert budget._in_use == 100
+    assert not budget.acquire(1, timeout=0.01)
+
+    budget.release(500)
+    assert budget._in_use == 0
+
+
+def test_check_image_accepts_valid_png():
+    uploaded_file = FakeUploadedFile(png_bytes(10, 10))
+    uploaded_file.seek(5)
+
+    assert upload_guard.check_image(uploaded_file) is None
+    assert uploaded_file.tell() == 0
+
+
+def test_check_image_rejects_oversized_file(monkeypatch):
+    uploaded_file = FakeUploadedFile(png_bytes(10, 10))
+    monkeypatch.setattr(utils, "MAX_UPLOAD_BYTES", uploaded_file.size - 1)
+
+    assert "ファイルサイズ" in upload_guard.check_image(uploaded_file)
+
+
+@pytest.mark.filterwarnings("ignore::PIL.Image.DecompressionBombWarning")
+@pytest.mark.parametrize("width, height", [
+    (8000, 8000),    # 上限の2倍未満（PILは警告のみ）
+    (20000, 20000),  # 上限の2倍以上（PILがDecompressionBombErrorを送出）
+])
+def test_check_image_rejects_too_many_pixels(width, height):
+    uploaded_file = FakeUploadedFile(png_header(width, height))
+
+    assert "ピクセル数" in upload_guard.check_image(uploaded_file)
+    assert uploaded_file.tell() == 0
+
+
+def test_check_image_rejects_non_image():
+    uploaded_file = FakeUploadedFile(b"this is not an image")
+
+    assert "読み込めませんでした" in upload_guard.check_image(uploaded_file)
+    assert uploaded_file.tell() == 0
+
+
+def test_make_preview_downscales():
+    uploaded_file = FakeUploadedFile(png_bytes(3000, 2000))
+
+    preview = upload_guard.make_preview(uploaded_file)
+
+    assert max(Image.open(io.BytesIO(preview)).size) == max(utils.PREVIEW_MAX_SIZE)
+    assert uploaded_file.tell() == 0
+    assert upload_guard._budget._in_use == 0
+
+
+def test_make_preview_returns_none_when_budget_exhausted(monkeypatch):
+    budget = upload_guard.UploadBudget(1000)
+    assert budget.acquire(1000)
+    monkeypatch.setattr(upload_guard, "_budget", budget)
+    monkeypatch.setattr(utils, "UPLOAD_BUDGET_TIMEOUT", 0.01)
+    uploaded_file = FakeUploadedFile(png_bytes(100, 100))
+
+    assert upload_guard.make_preview(uploaded_file) is None
+    assert uploaded_file.tell() == 0
+    assert budget._in_use == 1000
@@ -0,0 +1,182 @@
+"""
+このモジュールは、アップロードされた画像のサイズ検証とメモリ予算管理を行うユーティリティです。
+
+機能:
+- 画像のヘッダー情報のみを読み込み、ファイルサイズ・ピクセル数の上限を検証する関数
+- プロセス全体で処理中のアップロードが使用するメモリ量を制限するクラス
+- メモリ予算の範囲内で縮小プレビューを作成する関数
+
+関数:
+    check_image(uploaded_file)
+        アップロード画像のサイズをヘッダー情報のみで検証します。
+
+    reserve(nbytes)
+        指定したバイト数のメモリ予算を確保するコンテキストマネージャです。
+
+    reserve_upload(uploaded_file)
+        アップロード画像の分析処理に必要なメモリ予算を確保するコンテキストマネージャです。
+
+    make_preview(uploaded_file)
+        メモリ予算を確保したうえで、表示用に縮小したプレビュー画像を作成します。
+"""
+
+from __future__ import annotations
+import io                            # バイト列のストリーム操作
+import threading                     # スレッド間の排他制御
+from contextlib import contextmanager  # コンテキストマネージャ生成
+from PIL import Image                # 画像処理ライブラリ
+
+import utils                         # utilsモジュール
+
+# 展開後のサイズが極端に大きい画像（デコンプレッションボム）を拒否する
+Image.MAX_IMAGE_PIXELS = utils.MAX_IMAGE_PIXELS
+
+
+class UploadBudget:
+    """
+    処理中のアップロードが使用するメモリ量をプロセス全体で制限します。
+
+    Streamlitは各セッションを同一プロセス内のスレッドで実行するため、
+    モジュール変数として1つだけ生成し、全セッションで共有します。
+    """
+
+    def __init__(self, limit: int):
+        """
+        Args:
+            limit (int): メモリ予算の上限（バイト）。
+        """
+        self._limit = limit
+        self._in_use = 0
+        self._condition = threading.Condition()
+
+    def _clamp(self, nbytes: int) -> int:
+        # 予算を超える単一のアップロードでも、他に処理中のものがなければ受け付ける
+        return min(nbytes, self._limit)
+
+    def acquire(self, nbytes: int, timeout: float | None = None) -> bool:
+        """
+        メモリ予算を確保します。空きがない場合は解放されるまで待機します。
+
+        Args:
+            nbytes (int): 確保するバイト数。
+            timeout (float, optional): 最大待機時間（秒）。Noneの場合は無期限に待機します。
+
+        Returns:
+            bool: 確保できた場合はTrue、タイムアウトした場合はFalse。
+        """
+        nbytes = self._clamp(nbytes)
+        with self._condition:
+            acquired = self._condition.wait_for(lambda: self._in_use + nbytes <= self._limit, timeout)
+            if acquired:
+                self._in_use += nbytes
+            return acquired
+
+    def release(self, nbytes: int) -> None:
+        """
+        確保したメモリ予算を解放します。
+
+        Args:
+            nbytes (int): acquireで確保したバイト数。
+        """
+        nbytes = self._clamp(nbytes)
+        with self._condition:
+            self._in_use -= nbytes
+            self._condition.notify_all()
+
+
+# プロセス全体で共有するメモリ予算
+_budget = UploadBudget(utils.UPLOAD_MEMORY_BUDGET)
+
+
+def check_image(uploaded_file) -> str | None:
+    """
+    アップロード画像のサイズをヘッダー情報のみで検証します。
+    画素データはデコードしないため、大きな画像でもメモリを消費しません。
+
+    Args:
+        uploaded_file (UploadedFile): ストリームリットなどからアップロードされたファイル。
+
+    Returns:
+        str or None: 上限を超えている場合はエラーメッセージ、問題がない場合はNone。
+    """
+    if uploaded_file.size > utils.MAX_UPLOAD_BYTES:
+        return f"画像のファイルサイズが大きすぎます（上限: {utils.MAX_UPLOAD_BYTES // (1024 * 1024)} MB）"
+
+    uploaded_file.seek(0)
+    try:
+        # Image.openはヘッダーのみを読み込み、画素データは遅延デコードされる
+        with Image.open(uploaded_file) as image:
+            width, height = image.size
+    except Image.DecompressionBombError:
+        return f"画像のピクセル数が大きすぎます（上限: {utils.MAX_IMAGE_PIXELS:,} ピクセル）"
+    except OSError:
+        return "画像を読み込めませんでした。PNG形式の画像をアップロードしてください。"
+    finally:
+        uploaded_file.seek(0)  # 後続の処理のために先頭に戻す
+
+    if width * height > utils.MAX_IMAGE_PIXELS:
+        return f"画像のピクセル数が大きすぎます（上限: {utils.MAX_IMAGE_PIXELS:,} ピクセル）"
+    return None
+
+
+@contextmanager
+def reserve(nbytes: int):
+    """
+    指定したバイト数のメモリ予算を確保するコンテキストマネージャです。
+    ブロックを抜けると確保した予算は解放されます。
+
+    Args:
+        nbytes (int): 確保するバイト数。
+
+    Yields:
+        bool: 予算を確保できた場合はTrue、待機がタイムアウトした場合はFalse。
+    """
+    acquired = _budget.acquire(nbytes, timeout=utils.UPLOAD_BUDGET_TIMEOUT)
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            _budget.release(nbytes)
+
+
+def reserve_upload(uploaded_file):
+    """
+    アップロード画像の分析処理に必要なメモリ予算を確保するコンテキストマネージャです。
+    見積もりはファイルサイズ × utils.UPLOAD_MEMORY_FACTOR です。
+
+    Args:
+        uploaded_file (UploadedFile or None): アップロードされたファイル。Noneの場合は予算を確保しません。
+
+    Returns:
+        contextmanager: reserve(nbytes)と同じく、予算を確保できたかどうかをyieldします。
+    """
+    nbytes = 0 if uploaded_file is None else uploaded_file.size * utils.UPLOAD_MEMORY_FACTOR
+    return reserve(nbytes)
+
+
+def make_preview(uploaded_file) -> bytes | None:
+    """
+    メモリ予算を確保したうえで、表示用に縮小したプレビュー画像を作成します。
+    st.imageに元画像を渡すと再実行のたびにデコード・縮小されるため、
+    プレビューは画像ごとに1回だけ作成し、呼び出し側でキャッシュしてください。
+
+    Args:
+        uploaded_file (UploadedFile): check_imageで検証済みのアップロードファイル。
+
+    Returns:
+        bytes or None: PNG形式のプレビュー画像。予算の確保がタイムアウトした場合はNone。
+    """
+    uploaded_file.seek(0)
+    try:
+        with Image.open(uploaded_file) as image:
+            # デコード後の画素データ（最大4バイト/ピクセル）を予算として確保する
+            width, height = image.size
+            with reserve(width * height * 4) as reserved:
+                if not reserved:
+                    return None
+                image.thumbnail(utils.PREVIEW_MAX_SIZE)
+                buffer = io.BytesIO()
+                image.save(buffer, format="PNG")
+    finally:
+        uploaded_file.seek(0)  # 後続の処理のために先頭に戻す
+    return buffer.getvalue()
@@ -34,4 +34,23 @@ REGIST_INDEX = "handson-index"
 # 管理画面上で登録したテンプレートのID
 # TEMPLATE_ID = ""
 # 分割するトークン数を指定
-SPLIT_TOKENS = 512
\ No newline at end of file
+SPLIT_TOKENS = 512
+
+# ============================================= 
+# アップロード画像 制限設定
+# ============================================= 
+# アップロード画像の最大ファイルサイズ（バイト）
+MAX_UPLOAD_BYTES = 20 * 1024 * 1024
+# アップロード画像の最大ピクセル数（幅×高さ）
+MAX_IMAGE_PIXELS = 40_000_000
+# プロセス全体で処理中のアップロードに割り当てるメモリ予算（バイト）
+UPLOAD_MEMORY_BUDGET = 512 * 1024 * 1024
+# 1件のアップロードが画像分析中に占有するメモリの見積もり倍率（ファイルサイズ比）
+# 画像分析はストリーミングできないため、アップロードのバッファ（1倍）に加えて
+# Base64のbytes・str、データURL、OpenAIへのJSONボディ（各約1.33倍）が同時に存在しうる。
+# （スキャンAPIへの送信はストリーミングのため、ほとんど追加のメモリを使わない）
+UPLOAD_MEMORY_FACTOR = 7
+# メモリ予算の空きを待つ最大時間（秒）
+UPLOAD_BUDGET_TIMEOUT = 30
+# プレビュー画像の最大サイズ（幅, 高さ）
+PREVIEW_MAX_SIZE = (1024, 1024)